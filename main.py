@@ -2,28 +2,29 @@ import os
 
 import streamlit as st
 
-from utils.config_manager import ConfigManager
+from utils.config_manager import get_api_key_status, get_config_manager
 from utils.llm_manager import LLMManager
 
 
 def initialize_session_state():
     """Initialize the session state variables."""
-    if "chat_histories" not in st.session_state:
-        st.session_state.chat_histories = {}
+    # LLMManager holds the session's agents (and their memory), so it stays
+    # per-session; the ConfigManager is shared process-wide.
+    if "llm_manager" not in st.session_state:
+        st.session_state.llm_manager = LLMManager(get_config_manager())
 
-    if "config_manager" not in st.session_state:
-        st.session_state.config_manager = ConfigManager()
 
-    if "llm_manager" not in st.session_state:
-        st.session_state.llm_manager = LLMManager(st.session_state.config_manager)
+@st.cache_data
+def _read_readme(mtime: float) -> str:
+    """Read README.md; cached per file modification time."""
+    with open("README.md", "r") as file:
+        return file.read()
 
 
 def load_readme():
     """Load and display the README.md file."""
     try:
-        with open("README.md", "r") as file:
-            readme_content = file.read()
-        return readme_content
+        return _read_readme(os.path.getmtime("README.md"))
     except FileNotFoundError:
         return "README.md file not found. Please make sure it exists in the project root directory."
 
@@ -41,19 +42,25 @@ def main():
     initialize_session_state()
 
     # Get config
-    config = st.session_state.config_manager.get_config()
+    config = get_config_manager().get_config()
+    enabled_providers = [
+        (provider, data["api_key_env"])
+        for provider, data in config["providers"].items()
+        if data["enabled"]
+    ]
+    api_key_status = get_api_key_status(
+        tuple(api_key_env for _, api_key_env in enabled_providers)
+    )
 
     # Sidebar with information and menu
     with st.sidebar:
         # Display API key status
         st.header("API Key Status")
-        for provider, data in config["providers"].items():
-            if data["enabled"]:
-                api_key = os.getenv(data["api_key_env"], "")
-                if api_key:
-                    st.success(f"{provider.capitalize()}: ✓ Configured")
-                else:
-                    st.error(f"{provider.capitalize()}: ⚠ Not configured")
+        for provider, api_key_env in enabled_providers:
+            if api_key_status[api_key_env]:
+                st.success(f"{provider.capitalize()}: ✓ Configured")
+            else:
+                st.error(f"{provider.capitalize()}: ⚠ Not configured")
 
     # Display README.md content on the main page
     readme_content = load_readme()
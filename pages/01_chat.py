@@ -1,18 +1,81 @@
-import os
+import queue
+import threading
 import time
-from typing import Any, Dict, List, Tuple
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
 
 import streamlit as st
 
+from utils.config_manager import get_api_key_status, get_config_manager
+from utils.response_cache import ResponseCache
+from utils.streaming import pump_stream
+
+# Minimum seconds between redraws of a streaming response (~20 fps)
+STREAM_FLUSH_INTERVAL = 0.05
+
+
+@dataclass
+class ModelStream:
+    """Streaming state for a single model's response."""
+
+    name: str
+    placeholder: Any
+    start_time: float
+    chunks: List[str] = field(default_factory=list)
+    dirty: bool = False
+    last_flush: float = float("-inf")
+    elapsed: float = 0.0
+    failed: bool = False
+
+    def append(self, content: str) -> None:
+        """Add a chunk, redrawing the placeholder if its frame is due."""
+        self.chunks.append(content)
+        self.dirty = True
+        # Redraw at most once per frame so long responses aren't re-sent to
+        # the browser in full on every token
+        if time.monotonic() >= self.next_flush:
+            self.flush()
+
+    @property
+    def next_flush(self) -> float:
+        """The earliest monotonic time at which the placeholder may be redrawn."""
+        return self.last_flush + STREAM_FLUSH_INTERVAL
+
+    @property
+    def response(self) -> str:
+        """The response received so far."""
+        return "".join(self.chunks)
+
+    def flush(self) -> None:
+        """Redraw the placeholder with the response so far and a cursor."""
+        self.placeholder.markdown(self.response + "▌")
+        self.dirty = False
+        self.last_flush = time.monotonic()
+
+    def finish(self) -> None:
+        """Record the completion time."""
+        self.elapsed = time.time() - self.start_time
+
+    def fail(self, error_msg: str) -> None:
+        """End the response with an error message."""
+        self.chunks.append(error_msg)
+        self.dirty = False
+        self.failed = True
+        self.placeholder.error(error_msg)
+        self.finish()
+
 
 def main():  # noqa: C901
     st.subheader("Chat with Multiple LLMs")
 
-    # Verify if config is loaded
-    if "config_manager" not in st.session_state:
+    # Verify if the session is initialized
+    if "llm_manager" not in st.session_state:
         st.error("Configuration not loaded. Please restart the application.")
         return
 
+    config, enabled_models, missing_api_keys = get_config_snapshot()
+
     # Setup sidebar for global settings
     with st.sidebar:
         st.subheader("Chat Settings")
@@ -29,7 +92,6 @@ def main():  # noqa: C901
 
         # Number of history responses slider (only shown when history is enabled)
         if st.session_state.use_chat_history:
-            config = st.session_state.config_manager.get_config()
             max_history = config["ui"].get("max_chat_history", 10)
 
             if "num_history_responses" not in st.session_state:
@@ -42,9 +104,19 @@ def main():  # noqa: C901
                 value=st.session_state.num_history_responses,
                 help="Number of previous exchanges to include in context",
             )
+        else:
+            # Without history, repeated prompts can be answered from the cache
+            if "use_response_cache" not in st.session_state:
+                st.session_state.use_response_cache = True
+
+            st.session_state.use_response_cache = st.toggle(
+                "Reuse cached responses",
+                value=st.session_state.use_response_cache,
+                help="When disabled, repeating a prompt asks the models again "
+                "instead of showing their earlier answers",
+            )
 
     # Check if any models are enabled
-    enabled_models = st.session_state.config_manager.get_enabled_models()
     if not enabled_models:
         st.warning(
             "No models are enabled. Please go to the Settings page to enable models."
@@ -54,36 +126,29 @@ def main():  # noqa: C901
         return
 
     # Check API keys and providers
-    config = st.session_state.config_manager.get_config()
-    missing_api_keys = []
-    for provider, data in config["providers"].items():
-        if data["enabled"] and not os.getenv(data["api_key_env"]):
-            missing_api_keys.append(provider)
-
     if missing_api_keys:
-        warning_message = f"API keys not configured for: {', '.join(provider.capitalize() for provider in missing_api_keys)}."
+        warning_message = f"API keys not configured for: {', '.join(map(str.capitalize, missing_api_keys))}."
         st.warning(warning_message)
 
         # Add a convenient button to go to settings
         if st.button("Configure API Keys"):
             st.switch_page("pages/settings.py")
 
-    # Initialize model-specific chat histories
-    if "model_messages" not in st.session_state:
-        st.session_state.model_messages = {
-            model["name"]: [] for model in enabled_models
-        }
-
-    # Add any new models that weren't in the previous session
-    for model in enabled_models:
-        if model["name"] not in st.session_state.model_messages:
-            st.session_state.model_messages[model["name"]] = []
-
-    # Store models in session for rendering
-    st.session_state.enabled_models = enabled_models
-
     # Set up layout
     models_per_row = config["ui"].get("models_per_row", 2)
+    use_markdown = config.get("agent", {}).get("parameters", {}).get("markdown", True)
+    layout_key = (tuple(model["name"] for model in enabled_models), models_per_row)
+
+    # Initialize model-specific chat histories, only when the set of enabled
+    # models has changed since the last rerun
+    if (
+        "model_messages" not in st.session_state
+        or st.session_state.get("chat_layout_key") != layout_key
+    ):
+        model_messages = st.session_state.setdefault("model_messages", {})
+        for model_name in layout_key[0]:
+            model_messages.setdefault(model_name, [])
+        st.session_state.chat_layout_key = layout_key
 
     # Create a container for each model
     model_containers = {}
@@ -96,34 +161,9 @@ def main():  # noqa: C901
         for j, model in enumerate(row_models):
             model_name = model["name"]
             with cols[j]:
-                st.markdown(f"##### {model['display_name']}")
-                st.caption(f"Provider: {model['provider_name']}")
-
-                # Show model parameters
-                with st.expander("Model Parameters", expanded=False):
-                    if "parameters" in model:
-                        for param, value in model.get("parameters", {}).items():
-                            st.text(f"{param}: {value}")
-                    else:
-                        st.text("No parameters configured")
-
                 model_containers[model_name] = st.container()
-
-    # Display message history for each model
-    for model_name, container in model_containers.items():
-        with container:
-            for message in st.session_state.model_messages[model_name]:
-                with st.chat_message(message["role"]):
-                    # Handle markdown rendering based on configuration
-                    use_markdown = (
-                        config.get("agent", {})
-                        .get("parameters", {})
-                        .get("markdown", True)
-                    )
-                    if use_markdown:
-                        st.markdown(message["content"])
-                    else:
-                        st.text(message["content"])
+                with model_containers[model_name]:
+                    render_model_panel(model, use_markdown)
 
     # Handle new user input
     if prompt := st.chat_input("Message all models"):
@@ -149,21 +189,15 @@ def main():  # noqa: C901
                 # Show "Thinking..." indicator
                 status_indicators[model_name].info("Thinking...")
 
-        # Prepare response storage
-        if "current_responses" not in st.session_state:
-            st.session_state.current_responses = {}
-
-        for model_name in [m["name"] for m in enabled_models]:
-            st.session_state.current_responses[model_name] = ""
-
         # Start streaming responses
+        assistant_message_indices = {}
         for model in enabled_models:
             model_name = model["name"]
+            messages = st.session_state.model_messages[model_name]
 
             # Add empty assistant message to history (will update later)
-            st.session_state.model_messages[model_name].append(
-                {"role": "assistant", "content": ""}
-            )
+            messages.append({"role": "assistant", "content": ""})
+            assistant_message_indices[model_name] = len(messages) - 1
 
         try:
             # Run streaming in main thread (avoiding threading issues)
@@ -173,105 +207,259 @@ def main():  # noqa: C901
 
             # Update final responses in chat history
             for model_name, response in responses.items():
-                # Find the last assistant message and update it
+                # Update the assistant message added above
                 messages = st.session_state.model_messages[model_name]
-                for i in range(len(messages) - 1, -1, -1):
-                    if messages[i]["role"] == "assistant":
-                        messages[i]["content"] = response
-                        break
+                messages[assistant_message_indices[model_name]]["content"] = response
 
                 # Display timing information
                 if model_name in timing_info:
                     with model_containers[model_name]:
-                        st.caption(f"Response time: {timing_info[model_name]:.2f}s")
+                        if timing_info[model_name] is None:
+                            st.caption("Cached response")
+                        else:
+                            st.caption(f"Response time: {timing_info[model_name]:.2f}s")
 
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
 
 
+def render_model_panel(model: Dict[str, Any], use_markdown: bool) -> None:
+    """Render a model's header, parameters and chat history."""
+    st.markdown(f"##### {model['display_name']}")
+    st.caption(f"Provider: {model['provider_name']}")
+
+    # Show model parameters
+    with st.expander("Model Parameters", expanded=False):
+        if model.get("parameters"):
+            for param, value in model["parameters"].items():
+                st.text(f"{param}: {value}")
+        else:
+            st.text("No parameters configured")
+
+    # Display message history, rendering markdown based on configuration
+    render = st.markdown if use_markdown else st.text
+    for message in st.session_state.model_messages[model["name"]]:
+        with st.chat_message(message["role"]):
+            render(message["content"])
+
+
+def get_config_snapshot() -> (
+    Tuple[Dict[str, Any], List[Dict[str, Any]], Tuple[str, ...]]
+):
+    """
+    Read everything the chat page needs from the configuration in one pass.
+
+    Returns:
+        Tuple containing:
+        - The current configuration
+        - The list of enabled models
+        - The enabled providers whose API key environment variable is unset
+    """
+    config_manager = get_config_manager()
+    config = config_manager.get_config()
+    enabled_providers = [
+        (provider, data["api_key_env"])
+        for provider, data in config["providers"].items()
+        if data["enabled"]
+    ]
+    api_key_status = get_api_key_status(
+        tuple(api_key_env for _, api_key_env in enabled_providers)
+    )
+    missing_api_keys = tuple(
+        provider
+        for provider, api_key_env in enabled_providers
+        if not api_key_status[api_key_env]
+    )
+    return config, config_manager.get_enabled_models(), missing_api_keys
+
+
 def stream_responses_sync(
     models: List[Dict[str, Any]],
     prompt: str,
     placeholders: Dict[str, Any],
     status_indicators: Dict[str, Any],
-) -> Tuple[Dict[str, str], Dict[str, float]]:
+) -> Tuple[Dict[str, str], Dict[str, Optional[float]]]:
     """
     Stream responses from all models, updating placeholders.
 
     Returns:
         Tuple containing:
         - Dict mapping model names to their final responses
-        - Dict mapping model names to their response times
+        - Dict mapping model names to their response times, or None for
+          responses taken from the cache
+    """
+    chunk_queue = queue.Queue()
+    # Tells the worker threads to stop reading their streams if this run ends
+    # early, e.g. when Streamlit interrupts it for a rerun
+    stop_event = threading.Event()
+    response_cache = st.session_state.llm_manager.response_cache
+    cache_keys = _get_cache_keys(models, prompt)
+    cached_responses = {}
+    if st.session_state.get("use_response_cache", True):
+        cached_responses = {
+            model_name: response
+            for model_name, key in cache_keys.items()
+            if (response := response_cache.get(key)) is not None
+        }
+
+    streams, final_responses, timing_info = _start_streams(
+        models,
+        prompt,
+        placeholders,
+        status_indicators,
+        chunk_queue,
+        stop_event,
+        cached_responses,
+    )
+
+    # Render chunks until all generators are exhausted
+    try:
+        _render_chunks(streams, chunk_queue)
+    finally:
+        stop_event.set()
+
+    for stream in streams.values():
+        final_responses[stream.name] = stream.response
+        timing_info[stream.name] = stream.elapsed
+        if stream.name in cache_keys and not stream.failed:
+            response_cache.set(cache_keys[stream.name], final_responses[stream.name])
+
+    # Final update to remove cursor
+    for model_name, response in final_responses.items():
+        placeholders[model_name].markdown(response)
+
+    return final_responses, timing_info
+
+
+def _get_cache_keys(models: List[Dict[str, Any]], prompt: str) -> Dict[str, str]:
+    """
+    Get each model's response cache key for the prompt.
+
+    Without chat history a response depends only on the model, the agent
+    settings and the prompt, so identical requests can be answered from the
+    cache. With history it also depends on the conversation, so nothing is
+    cached.
+    """
+    if st.session_state.use_chat_history:
+        return {}
+
+    agent_parameters = (
+        get_config_manager().get_config().get("agent", {}).get("parameters", {})
+    )
+    return {
+        model["name"]: ResponseCache.make_key(model, agent_parameters, prompt)
+        for model in models
+    }
+
+
+def _start_streams(
+    models: List[Dict[str, Any]],
+    prompt: str,
+    placeholders: Dict[str, Any],
+    status_indicators: Dict[str, Any],
+    chunk_queue: queue.Queue,
+    stop_event: threading.Event,
+    cached_responses: Dict[str, str],
+) -> Tuple[Dict[str, ModelStream], Dict[str, str], Dict[str, Optional[float]]]:
     """
-    # Create generators for all models
-    generators = {}
+    Start a worker thread streaming each model's response into chunk_queue.
+
+    Models with a response in cached_responses, or that fail to start, are
+    not streamed.
+
+    Returns:
+        Tuple containing:
+        - Dict mapping model names to their streams
+        - Dict mapping model names to responses that are already final
+        - Dict mapping model names to the response times of those, or None
+          for cached responses
+    """
+    streams = {}
     final_responses = {}
-    active_generators = set()
     timing_info = {}
-    start_times = {}
 
     for model in models:
         model_name = model["name"]
+        # Record start time
+        start_time = time.time()
         try:
             # Clear thinking indicator
             status_indicators[model_name].empty()
 
-            # Record start time
-            start_times[model_name] = time.time()
+            # A cached response is already complete, so it is shown at once
+            # with the final update rather than replayed through a
+            # ModelStream, which would only delay it
+            if model_name in cached_responses:
+                final_responses[model_name] = cached_responses[model_name]
+                timing_info[model_name] = None
+                continue
 
             # Get agent with history settings applied
             agent = get_agent_with_history(model)
-            generators[model_name] = agent.run(prompt, stream=True)
-            active_generators.add(model_name)
-            final_responses[model_name] = ""
+            generator = agent.run(prompt, stream=True)
         except Exception as e:
             error_message = f"Error: {str(e)}"
             final_responses[model_name] = error_message
             placeholders[model_name].error(error_message)
-            timing_info[model_name] = time.time() - start_times.get(
-                model_name, time.time()
-            )
-
-    # Stream responses until all generators are exhausted
-    while active_generators:
-        for model_name in list(active_generators):
-            try:
-                # Get next chunk
-                generator = generators[model_name]
-                chunk = next(generator, None)
-
-                if chunk is None:
-                    active_generators.remove(model_name)
-                    # Record completion time
-                    timing_info[model_name] = time.time() - start_times[model_name]
-                    continue
-
-                if chunk.content:
-                    # Update response
-                    final_responses[model_name] += chunk.content
-                    # Update placeholder with cursor
-                    placeholders[model_name].markdown(final_responses[model_name] + "▌")
-
-            except StopIteration:
-                active_generators.remove(model_name)
-                # Record completion time
-                timing_info[model_name] = time.time() - start_times[model_name]
-            except Exception as e:
-                error_msg = f"Error during streaming: {str(e)}"
-                final_responses[model_name] += error_msg
-                placeholders[model_name].error(error_msg)
-                active_generators.remove(model_name)
-                # Record completion time
-                timing_info[model_name] = time.time() - start_times[model_name]
-
-        # Small delay to avoid UI freezing
-        time.sleep(0.05)
-
-    # Final update to remove cursor
-    for model_name, response in final_responses.items():
-        placeholders[model_name].markdown(response)
+            timing_info[model_name] = time.time() - start_time
+            continue
 
-    return final_responses, timing_info
+        streams[model_name] = ModelStream(
+            model_name, placeholders[model_name], start_time
+        )
+        # Pump each generator on its own thread so a chunk from any model is
+        # rendered as soon as it arrives, instead of polling them in turn
+        threading.Thread(
+            target=pump_stream,
+            args=(
+                generator,
+                partial(_put_chunk, chunk_queue, model_name),
+                stop_event,
+            ),
+            daemon=True,
+        ).start()
+
+    return streams, final_responses, timing_info
+
+
+def _put_chunk(chunk_queue: queue.Queue, model_name: str, item: Any) -> None:
+    """Queue an item from a model's stream worker, tagged with the model name."""
+    chunk_queue.put((model_name, item))
+
+
+def _render_chunks(streams: Dict[str, ModelStream], chunk_queue: queue.Queue) -> None:
+    """Render chunks from the worker threads until every stream has ended."""
+    active_streams = len(streams)
+    while active_streams:
+        # Only wake up on a timeout when buffered text is due to be shown
+        next_flush = min(
+            (stream.next_flush for stream in streams.values() if stream.dirty),
+            default=None,
+        )
+        try:
+            model_name, item = chunk_queue.get(
+                timeout=(
+                    None
+                    if next_flush is None
+                    else max(next_flush - time.monotonic(), 0)
+                )
+            )
+        except queue.Empty:
+            now = time.monotonic()
+            for stream in streams.values():
+                if stream.dirty and now >= stream.next_flush:
+                    stream.flush()
+            continue
+
+        stream = streams[model_name]
+        if item is None:
+            stream.finish()
+            active_streams -= 1
+        elif isinstance(item, Exception):
+            stream.fail(f"Error during streaming: {str(item)}")
+            active_streams -= 1
+        else:
+            stream.append(item)
 
 
 def get_agent_with_history(model: Dict[str, Any]):
@@ -2,13 +2,13 @@ import os
 
 import streamlit as st
 
+from utils.config_manager import get_api_key_status, get_config_manager
 
-def api_key_settings():
+
+def api_key_settings(config):
     """Settings for API keys environment variables."""
     st.header("API Key Settings")
 
-    config = st.session_state.config_manager.get_config()
-
     # Display instructions
     st.info(
         """
@@ -17,195 +17,295 @@ def api_key_settings():
     """
     )
 
-    for provider, data in config["providers"].items():
-        with st.expander(f"{provider.capitalize()} API Key"):
-            current_key_env = data["api_key_env"]
-            actual_key_value = os.getenv(current_key_env, "")
+    api_key_status = get_api_key_status(
+        tuple(data["api_key_env"] for data in config["providers"].values())
+    )
 
-            # Show status
-            if actual_key_value:
-                st.success(
-                    f"✓ Found API key in environment variable '{current_key_env}'"
-                )
-            else:
-                st.error(
-                    f"✗ No API key found in environment variable '{current_key_env}'"
+    # Only the selected provider's widgets are built; the key status of every
+    # provider is shown in the dropdown
+    provider_labels = {
+        provider: f"{provider.capitalize()} "
+        + ("✓" if api_key_status[data["api_key_env"]] else "✗")
+        for provider, data in config["providers"].items()
+    }
+    provider = st.selectbox(
+        "Provider",
+        list(provider_labels),
+        format_func=provider_labels.get,
+        key="api_key_settings_provider",
+    )
+    if provider is None:
+        return
+
+    provider_name = provider.capitalize()
+    current_key_env = config["providers"][provider]["api_key_env"]
+
+    # Show status
+    if api_key_status[current_key_env]:
+        st.success(f"✓ Found API key in environment variable '{current_key_env}'")
+    else:
+        st.error(f"✗ No API key found in environment variable '{current_key_env}'")
+
+    # Typing in these fields does not rerun the page; only the submit
+    # buttons do
+    with st.form(key=f"api_key_form_{provider}", border=False):
+        # Edit environment variable name
+        st.text_input(
+            f"Environment variable name for {provider_name} API key",
+            value=current_key_env,
+            key=f"api_key_env_{provider}",
+        )
+        st.form_submit_button(
+            "Update", on_click=_on_api_key_env_submitted, args=(provider,)
+        )
+
+        # Add or update API key value
+        st.divider()
+        st.text_input(
+            f"API Key Value for {provider_name}",
+            value="",
+            type="password",
+            key=f"api_key_value_{provider}",
+            placeholder="Enter your API key to add/update it",
+        )
+        st.form_submit_button(
+            "Save API Key", on_click=_on_api_key_submitted, args=(provider,)
+        )
+
+    _show_feedback("api_key_feedback")
+
+
+def _show_feedback(key):
+    """Show, once, a message left in session state by a callback."""
+    feedback = st.session_state.pop(key, None)
+    if feedback:
+        level, message = feedback
+        getattr(st, level)(message)
+
+
+# The callbacks below run before the page is rerun, so the updated config is
+# rendered straight away without a forced st.rerun()
+
+
+def _on_api_key_env_submitted(provider):
+    """Save a provider's API key environment variable name."""
+    config_manager = get_config_manager()
+    current_key_env = config_manager.get_provider_config(provider)["api_key_env"]
+    new_key_env = st.session_state[f"api_key_env_{provider}"]
+
+    if new_key_env and new_key_env != current_key_env:
+        config_manager.update_api_key_env(provider, new_key_env)
+        st.session_state.api_key_feedback = (
+            "success",
+            f"Updated environment variable for {provider.capitalize()} API key!",
+        )
+
+
+def _on_api_key_submitted(provider):
+    """Save a provider's API key value to the .env file."""
+    config_manager = get_config_manager()
+    api_key_env = config_manager.get_provider_config(provider)["api_key_env"]
+    api_key_value = st.session_state[f"api_key_value_{provider}"]
+
+    if not api_key_value:
+        feedback = ("warning", "Please enter an API key value")
+    elif api_key_value == os.environ.get(api_key_env):
+        # Already loaded from .env, so there is nothing to write
+        feedback = ("info", f"API key for {provider.capitalize()} is unchanged")
+    elif config_manager.save_api_key(api_key_env, api_key_value):
+        feedback = (
+            "success",
+            f"API key for {provider.capitalize()} saved to .env file!",
+        )
+    else:
+        feedback = ("error", "Failed to save API key. Check file permissions.")
+    st.session_state.api_key_feedback = feedback
+
+
+def _on_provider_toggled(provider, key):
+    """Save a provider checkbox change."""
+    get_config_manager().toggle_provider(provider, st.session_state[key])
+
+
+def _model_row(model):
+    """A model's row in the provider models table."""
+    parameters = model.get("parameters", {})
+    return {
+        "enabled": model["enabled"],
+        "display_name": model["display_name"],
+        "temperature": parameters.get("temperature", 0.7),
+        "max_tokens": parameters.get(
+            "max_tokens", parameters.get("max_output_tokens", 1000)
+        ),
+    }
+
+
+def _on_models_edited(provider, key):
+    """Save the rows changed in a provider's models table."""
+    config_manager = get_config_manager()
+    models = config_manager.get_provider_config(provider)["models"]
+
+    # edited_rows holds every edit since the table was created, so only the
+    # values that differ from the config are changed, and saved together
+    with config_manager.batch_updates():
+        for index, changes in st.session_state[key]["edited_rows"].items():
+            model = models[int(index)]
+            row = _model_row(model)
+            # Cells cleared in the table keep their configured value
+            edited = {
+                **row,
+                **{
+                    column: value
+                    for column, value in changes.items()
+                    if value is not None
+                },
+            }
+
+            if edited["enabled"] != row["enabled"]:
+                config_manager.toggle_model(provider, model["name"], edited["enabled"])
+            if (
+                edited["temperature"] != row["temperature"]
+                or edited["max_tokens"] != row["max_tokens"]
+            ):
+                config_manager.update_model_parameters(
+                    provider,
+                    model["name"],
+                    edited["temperature"],
+                    int(edited["max_tokens"]),
                 )
 
-            # Edit environment variable name
-            new_key_env = st.text_input(
-                f"Environment variable name for {provider.capitalize()} API key",
-                value=current_key_env,
-                key=f"api_key_env_{provider}",
-            )
 
-            if st.button("Update", key=f"update_env_{provider}"):
-                if new_key_env and new_key_env != current_key_env:
-                    st.session_state.config_manager.update_api_key_env(
-                        provider, new_key_env
-                    )
-                    st.success(
-                        f"Updated environment variable for {provider.capitalize()} API key!"
-                    )
-                    st.rerun()
-
-            # Add or update API key value
-            st.divider()
-            api_key_value = st.text_input(
-                f"API Key Value for {provider.capitalize()}",
-                value="",
-                type="password",
-                key=f"api_key_value_{provider}",
-                placeholder="Enter your API key to add/update it",
-            )
+def _on_new_model_submitted(provider):
+    """Add the model entered in a provider's new model form."""
+    new_model_name = st.session_state[f"new_model_name_{provider}"]
+    new_model_display_name = st.session_state[f"new_model_display_name_{provider}"]
 
-            if st.button("Save API Key", key=f"save_key_{provider}"):
-                if api_key_value:
-                    if st.session_state.config_manager.save_api_key(
-                        current_key_env, api_key_value
-                    ):
-                        st.success(
-                            f"API key for {provider.capitalize()} saved to .env file!"
-                        )
-                        st.rerun()
-                    else:
-                        st.error("Failed to save API key. Check file permissions.")
-                else:
-                    st.warning("Please enter an API key value")
-
-
-def model_settings():
+    if not (new_model_name and new_model_display_name):
+        st.session_state.model_settings_feedback = (
+            "error",
+            "Model ID and Display Name are required",
+        )
+        return
+
+    get_config_manager().add_model(
+        provider,
+        new_model_name,
+        new_model_display_name,
+        st.session_state[f"new_model_temp_{provider}"],
+        st.session_state[f"new_model_tokens_{provider}"],
+    )
+    st.session_state.model_settings_feedback = (
+        "success",
+        f"Added new model: {new_model_display_name}",
+    )
+    st.session_state[f"adding_model_{provider}"] = False
+
+
+def _on_new_model_cancelled(provider):
+    """Close a provider's new model form."""
+    st.session_state[f"adding_model_{provider}"] = False
+
+
+def model_settings(config):
     """Settings for models and providers."""
     st.header("Models Configuration")
 
-    config = st.session_state.config_manager.get_config()
+    # Only the selected provider's widgets are built
+    provider = st.selectbox(
+        "Provider",
+        list(config["providers"]),
+        format_func=str.capitalize,
+        key="model_settings_provider",
+    )
+    if provider is None:
+        return
+
+    _provider_models(provider, config["providers"][provider])
+
 
-    for provider, data in config["providers"].items():
-        with st.expander(f"{provider.capitalize()} Models"):
-            # Provider toggle
-            provider_enabled = st.checkbox(
-                f"Enable {provider.capitalize()}",
-                value=data["enabled"],
-                key=f"provider_{provider}",
+@st.fragment
+def _provider_models(provider, data):
+    """
+    Settings for one provider's models, rendered as a fragment so that
+    editing them only reruns this provider's block.
+    """
+    provider_name = provider.capitalize()
+
+    # Provider toggle, saved by its callback before the rerun
+    provider_key = f"provider_{provider}"
+    provider_enabled = st.checkbox(
+        f"Enable {provider_name}",
+        value=data["enabled"],
+        key=provider_key,
+        on_change=_on_provider_toggled,
+        args=(provider, provider_key),
+    )
+
+    if not provider_enabled:
+        return
+
+    # All of the provider's models are edited in one table; changes are
+    # saved by its callback before the rerun
+    models_key = f"models_{provider}"
+    st.data_editor(
+        [_model_row(model) for model in data["models"]],
+        column_config={
+            "enabled": st.column_config.CheckboxColumn("Enabled"),
+            "display_name": st.column_config.TextColumn("Model", disabled=True),
+            "temperature": st.column_config.NumberColumn(
+                "Temperature", min_value=0.0, max_value=1.0, step=0.1
+            ),
+            "max_tokens": st.column_config.NumberColumn(
+                "Max Tokens", min_value=100, max_value=8000, step=100
+            ),
+        },
+        hide_index=True,
+        num_rows="fixed",
+        key=models_key,
+        on_change=_on_models_edited,
+        args=(provider, models_key),
+    )
+
+    # Add new model button
+    st.divider()
+    if st.button("Add New Model", key=f"add_model_{provider}"):
+        st.session_state[f"adding_model_{provider}"] = True
+
+    # Form to add a new model
+    if st.session_state.get(f"adding_model_{provider}", False):
+        with st.form(key=f"new_model_form_{provider}"):
+            st.subheader(f"Add New Model for {provider_name}")
+
+            st.text_input("Model ID/Name", key=f"new_model_name_{provider}")
+            st.text_input("Display Name", key=f"new_model_display_name_{provider}")
+            st.slider(
+                "Temperature",
+                min_value=0.0,
+                max_value=1.0,
+                value=0.7,
+                step=0.1,
+                key=f"new_model_temp_{provider}",
+            )
+            st.number_input(
+                "Max Tokens",
+                min_value=100,
+                max_value=8000,
+                value=1024,
+                step=100,
+                key=f"new_model_tokens_{provider}",
             )
 
-            if provider_enabled != data["enabled"]:
-                st.session_state.config_manager.toggle_provider(
-                    provider, provider_enabled
+            col1, col2 = st.columns(2)
+            with col1:
+                st.form_submit_button(
+                    "Add Model", on_click=_on_new_model_submitted, args=(provider,)
+                )
+            with col2:
+                st.form_submit_button(
+                    "Cancel", on_click=_on_new_model_cancelled, args=(provider,)
                 )
-                st.rerun()
-
-            if not provider_enabled:
-                continue
-
-            # Model toggles and settings
-            for i, model in enumerate(data["models"]):
-                col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
-
-                with col1:
-                    model_enabled = st.checkbox(
-                        model["display_name"],
-                        value=model["enabled"],
-                        key=f"model_{provider}_{model['name']}",
-                    )
-
-                    if model_enabled != model["enabled"]:
-                        st.session_state.config_manager.toggle_model(
-                            provider, model["name"], model_enabled
-                        )
-
-                if model_enabled:
-                    with col2:
-                        temperature = st.slider(
-                            "Temperature",
-                            min_value=0.0,
-                            max_value=1.0,
-                            value=model.get("parameters", {}).get("temperature", 0.7),
-                            step=0.1,
-                            key=f"temp_{provider}_{model['name']}",
-                        )
-
-                    with col3:
-                        max_tokens = st.number_input(
-                            "Max Tokens",
-                            min_value=100,
-                            max_value=8000,
-                            value=model.get("parameters", {}).get(
-                                "max_tokens",
-                                model.get("parameters", {}).get(
-                                    "max_output_tokens", 1000
-                                ),
-                            ),
-                            step=100,
-                            key=f"tokens_{provider}_{model['name']}",
-                        )
-
-                    with col4:
-                        if st.button(
-                            "Update", key=f"update_{provider}_{model['name']}"
-                        ):
-                            st.session_state.config_manager.update_model_parameters(
-                                provider, model["name"], temperature, max_tokens
-                            )
-                            st.success(f"{model['display_name']} settings updated!")
-
-            # Add new model button
-            st.divider()
-            if st.button("Add New Model", key=f"add_model_{provider}"):
-                st.session_state[f"adding_model_{provider}"] = True
-
-            # Form to add a new model
-            if st.session_state.get(f"adding_model_{provider}", False):
-                with st.form(key=f"new_model_form_{provider}"):
-                    st.subheader(f"Add New Model for {provider.capitalize()}")
-
-                    new_model_name = st.text_input(
-                        "Model ID/Name", key=f"new_model_name_{provider}"
-                    )
-                    new_model_display_name = st.text_input(
-                        "Display Name", key=f"new_model_display_name_{provider}"
-                    )
-                    new_model_temperature = st.slider(
-                        "Temperature",
-                        min_value=0.0,
-                        max_value=1.0,
-                        value=0.7,
-                        step=0.1,
-                        key=f"new_model_temp_{provider}",
-                    )
-                    new_model_max_tokens = st.number_input(
-                        "Max Tokens",
-                        min_value=100,
-                        max_value=8000,
-                        value=1024,
-                        step=100,
-                        key=f"new_model_tokens_{provider}",
-                    )
-
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        submit_button = st.form_submit_button("Add Model")
-                    with col2:
-                        cancel_button = st.form_submit_button("Cancel")
-
-                    if submit_button:
-                        if new_model_name and new_model_display_name:
-                            st.session_state.config_manager.add_model(
-                                provider,
-                                new_model_name,
-                                new_model_display_name,
-                                new_model_temperature,
-                                new_model_max_tokens,
-                            )
-                            st.success(f"Added new model: {new_model_display_name}")
-                            st.session_state[f"adding_model_{provider}"] = False
-                            st.rerun()
-                        else:
-                            st.error("Model ID and Display Name are required")
-
-                    if cancel_button:
-                        st.session_state[f"adding_model_{provider}"] = False
-                        st.rerun()
+
+    _show_feedback("model_settings_feedback")
 
 
 def provider_management():
@@ -216,102 +316,144 @@ def provider_management():
         with st.form(key="new_provider_form"):
             st.subheader("Add New Provider")
 
-            provider_id = st.text_input(
+            st.text_input(
                 "Provider ID (lowercase, no spaces)",
                 placeholder="e.g. openai, anthropic, mistral",
+                key="new_provider_id",
             )
-            provider_class = st.text_input(
-                "Provider Class Name", placeholder="e.g. OpenAIChat, Claude, Mistral"
+            st.text_input(
+                "Provider Class Name",
+                placeholder="e.g. OpenAIChat, Claude, Mistral",
+                key="new_provider_class",
             )
-            provider_module = st.text_input(
-                "Provider Module Path", placeholder="e.g. agno.models.openai"
+            st.text_input(
+                "Provider Module Path",
+                placeholder="e.g. agno.models.openai",
+                key="new_provider_module",
             )
-            api_key_env = st.text_input(
-                "API Key Environment Variable", placeholder="e.g. OPENAI_API_KEY"
+            st.text_input(
+                "API Key Environment Variable",
+                placeholder="e.g. OPENAI_API_KEY",
+                key="new_provider_api_key_env",
             )
 
             # Optional first model
             st.subheader("Initial Model (Optional)")
-            add_model = st.checkbox("Add initial model", value=True)
+            add_model = st.checkbox(
+                "Add initial model", value=True, key="new_provider_add_model"
+            )
 
             if add_model:
-                model_name = st.text_input(
-                    "Model ID/Name", placeholder="e.g. gpt-4o, claude-3-opus"
+                st.text_input(
+                    "Model ID/Name",
+                    placeholder="e.g. gpt-4o, claude-3-opus",
+                    key="new_provider_model_name",
                 )
-                model_display_name = st.text_input(
-                    "Display Name", placeholder="e.g. GPT-4o, Claude 3 Opus"
+                st.text_input(
+                    "Display Name",
+                    placeholder="e.g. GPT-4o, Claude 3 Opus",
+                    key="new_provider_model_display_name",
                 )
 
-            submit_button = st.form_submit_button("Add Provider")
-
-            if submit_button:
-                if provider_id and provider_class and provider_module and api_key_env:
-                    if add_model and (not model_name or not model_display_name):
-                        st.error(
-                            "Model ID and Display Name are required if adding an initial model"
-                        )
-                    else:
-                        result = st.session_state.config_manager.add_provider(
-                            provider_id,
-                            provider_class,
-                            provider_module,
-                            api_key_env,
-                            model_name if add_model else None,
-                            model_display_name if add_model else None,
-                        )
-                        if result:
-                            st.success(f"Added new provider: {provider_id}")
-                            st.rerun()
-                else:
-                    st.error("All provider fields are required")
-
-
-def ui_settings():
-    """Settings for the UI."""
+            st.form_submit_button("Add Provider", on_click=_on_new_provider_submitted)
+
+    _show_feedback("provider_management_feedback")
+
+
+def _on_new_provider_submitted():
+    """Add the provider entered in the new provider form."""
+    state = st.session_state
+    provider_id = state.new_provider_id
+    add_model = state.new_provider_add_model
+    model_name = state.get("new_provider_model_name")
+    model_display_name = state.get("new_provider_model_display_name")
+
+    if not (
+        provider_id
+        and state.new_provider_class
+        and state.new_provider_module
+        and state.new_provider_api_key_env
+    ):
+        state.provider_management_feedback = (
+            "error",
+            "All provider fields are required",
+        )
+    elif add_model and (not model_name or not model_display_name):
+        state.provider_management_feedback = (
+            "error",
+            "Model ID and Display Name are required if adding an initial model",
+        )
+    elif get_config_manager().add_provider(
+        provider_id,
+        state.new_provider_class,
+        state.new_provider_module,
+        state.new_provider_api_key_env,
+        model_name if add_model else None,
+        model_display_name if add_model else None,
+    ):
+        state.provider_management_feedback = (
+            "success",
+            f"Added new provider: {provider_id}",
+        )
+
+
+@st.fragment
+def ui_settings(config_manager, config):
+    """
+    Settings for the UI, rendered as a fragment so that saving them only
+    reruns this section.
+    """
     st.header("UI Settings")
-
-    config = st.session_state.config_manager.get_config()
     ui_config = config["ui"]
 
-    models_per_row = st.slider(
-        "Models per row",
-        min_value=1,
-        max_value=4,
-        value=ui_config.get("models_per_row", 2),
-        step=1,
-    )
+    # Dragging the slider does not rerun anything until Update is pressed
+    with st.form(key="ui_settings_form", border=False):
+        models_per_row = st.slider(
+            "Models per row",
+            min_value=1,
+            max_value=4,
+            value=ui_config.get("models_per_row", 2),
+            step=1,
+        )
+
+        submitted = st.form_submit_button("Update UI Settings")
 
-    if st.button("Update UI Settings"):
-        st.session_state.config_manager.update_ui_settings(models_per_row)
+    if submitted:
+        config_manager.update_ui_settings(models_per_row)
         st.success("UI settings updated!")
 
 
 def main():
     st.title("Settings")
 
-    # Verify if config is loaded
-    if "config_manager" not in st.session_state:
-        st.error("Configuration not loaded. Please restart the application.")
-        return
-
-    # Initialize session state for adding models
-    for provider in st.session_state.config_manager.get_config()["providers"]:
-        if f"adding_model_{provider}" not in st.session_state:
-            st.session_state[f"adding_model_{provider}"] = False
+    config_manager = get_config_manager()
+    config = config_manager.get_config()
 
     # Sections
-    api_key_settings()
+    api_key_settings(config)
     st.divider()
-    model_settings()
+    model_settings(config)
     st.divider()
     provider_management()
     st.divider()
-    ui_settings()
+    ui_settings(config_manager, config)
 
     # Reset chat history button
     st.divider()
+    _chat_history_actions()
+
+
+@st.fragment
+def _chat_history_actions():
+    """
+    Clear All Chat History button, rendered as a fragment so that clicking it
+    does not rerun the settings sections above.
+    """
     if st.button("Clear All Chat History", type="primary"):
-        st.session_state.chat_histories = {}
+        # The chat page recreates an empty history for each enabled model
+        st.session_state.pop("model_messages", None)
+        if "llm_manager" in st.session_state:
+            st.session_state.llm_manager.clear_history()
         st.success("Chat history cleared!")
 
 
@@ -1,37 +1,110 @@
 import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import streamlit as st
 import yaml
 from dotenv import find_dotenv, load_dotenv, set_key
 
+# Use the libyaml-backed loader and dumper when PyYAML was built with them
+try:
+    from yaml import CSafeDumper as YamlDumper
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeDumper as YamlDumper
+    from yaml import SafeLoader as YamlLoader
+
 # Load environment variables
 load_dotenv()
 
+# Name of the max tokens parameter for providers that don't use "max_tokens"
+MAX_TOKENS_KEYS = {"google": "max_output_tokens"}
+
 
 class ConfigManager:
     def __init__(self, config_path: str = "config/models_config.yaml"):
         self.config_path = config_path
+        # Bumped whenever the configuration is loaded or changed, so derived
+        # values can be cached against it
+        self.version = 0
+        self._enabled_models_cache = None
+        self._dotenv_path = None
+        # The instance is shared by every session, so changes to the config
+        # and saves are serialised. Reentrant, as updates save while holding
+        # it and may run inside batch_updates().
+        self._lock = threading.RLock()
+        # Saves are deferred while inside batch_updates()
+        self._batch_depth = 0
+        self._batch_dirty = False
         self._load_config()
 
     def _load_config(self) -> None:
         """Load configuration from YAML file."""
         try:
             with open(self.config_path, "r") as file:
-                self.config = yaml.safe_load(file)
+                self.config = yaml.load(file, Loader=YamlLoader)
         except Exception as e:
             st.error(f"Error loading configuration: {str(e)}")
             self.config = self._get_default_config()
 
+        # An empty "parameters:" key in the YAML loads as None; normalise it
+        # once so every reader can treat parameters as a dict
+        for provider_data in self.config["providers"].values():
+            for model in provider_data["models"]:
+                if not model.get("parameters"):
+                    model["parameters"] = {}
+        self.version += 1
+
     def _save_config(self) -> None:
         """Save configuration to YAML file."""
-        try:
-            os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
-            with open(self.config_path, "w") as file:
-                yaml.dump(self.config, file, default_flow_style=False)
-        except Exception as e:
-            st.error(f"Error saving configuration: {str(e)}")
+        with self._lock:
+            self.version += 1
+            if self._batch_depth:
+                self._batch_dirty = True
+                return
+
+            tmp_path = None
+            try:
+                config_dir = os.path.dirname(self.config_path)
+                os.makedirs(config_dir, exist_ok=True)
+                # Write to a temporary file of our own and swap it in, so the
+                # config file is never left half-written
+                fd, tmp_path = tempfile.mkstemp(dir=config_dir, suffix=".tmp")
+                with os.fdopen(fd, "w") as file:
+                    yaml.dump(
+                        self.config, file, Dumper=YamlDumper, default_flow_style=False
+                    )
+                # mkstemp creates the file private to the owner; keep the
+                # permissions the config file already had
+                if os.path.exists(self.config_path):
+                    shutil.copymode(self.config_path, tmp_path)
+                os.replace(tmp_path, self.config_path)
+            except Exception as e:
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                st.error(f"Error saving configuration: {str(e)}")
+
+    @contextmanager
+    def batch_updates(self) -> Iterator[None]:
+        """
+        Group several updates into a single save of the configuration.
+
+        The lock is held for the whole batch, so updates from other sessions
+        wait for it rather than being folded into its save.
+        """
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._batch_dirty:
+                    self._batch_dirty = False
+                    self._save_config()
 
     def get_config(self) -> Dict[str, Any]:
         """Get the current configuration."""
@@ -39,8 +112,9 @@ class ConfigManager:
 
     def update_config(self, new_config: Dict[str, Any]) -> None:
         """Update the configuration and save it."""
-        self.config = new_config
-        self._save_config()
+        with self._lock:
+            self.config = new_config
+            self._save_config()
 
     def get_provider_config(self, provider_id: str) -> Dict[str, Any]:
         """Get configuration for a specific provider."""
@@ -49,7 +123,18 @@ class ConfigManager:
         return None
 
     def get_enabled_models(self) -> List[Dict[str, Any]]:
-        """Get a list of all enabled models with their provider details."""
+        """
+        Get a list of all enabled models with their provider details.
+
+        The list is rebuilt only when the configuration version changes, so
+        callers must not modify it.
+        """
+        if (
+            self._enabled_models_cache is not None
+            and self._enabled_models_cache[0] == self.version
+        ):
+            return self._enabled_models_cache[1]
+
         enabled_models = []
 
         for provider_id, provider_data in self.config["providers"].items():
@@ -66,56 +151,82 @@ class ConfigManager:
                     }
                     enabled_models.append(model_info)
 
+        self._enabled_models_cache = (self.version, enabled_models)
         return enabled_models
 
+    @staticmethod
+    def _set_value(settings: Dict[str, Any], key: str, value: Any) -> bool:
+        """Set a configuration value, returning whether it changed."""
+        if key in settings and settings[key] == value:
+            return False
+        settings[key] = value
+        return True
+
+    # The update methods below only save the configuration when a value
+    # actually changed
+
     def update_api_key_env(self, provider: str, api_key_env: str) -> None:
         """Update API key environment variable name for a specific provider."""
-        if provider in self.config["providers"]:
-            self.config["providers"][provider]["api_key_env"] = api_key_env
-            self._save_config()
+        with self._lock:
+            if provider in self.config["providers"] and self._set_value(
+                self.config["providers"][provider], "api_key_env", api_key_env
+            ):
+                self._save_config()
 
     def toggle_model(self, provider: str, model_name: str, enabled: bool) -> None:
         """Toggle a model's enabled status."""
-        if provider in self.config["providers"]:
-            for model in self.config["providers"][provider]["models"]:
-                if model["name"] == model_name:
-                    model["enabled"] = enabled
-                    self._save_config()
-                    break
+        with self._lock:
+            if provider in self.config["providers"]:
+                for model in self.config["providers"][provider]["models"]:
+                    if model["name"] == model_name:
+                        if self._set_value(model, "enabled", enabled):
+                            self._save_config()
+                        break
 
     def toggle_provider(self, provider: str, enabled: bool) -> None:
         """Toggle a provider's enabled status."""
-        if provider in self.config["providers"]:
-            self.config["providers"][provider]["enabled"] = enabled
-            self._save_config()
+        with self._lock:
+            if provider in self.config["providers"] and self._set_value(
+                self.config["providers"][provider], "enabled", enabled
+            ):
+                self._save_config()
 
     def update_ui_settings(self, models_per_row: int) -> None:
         """Update UI settings."""
-        self.config["ui"]["models_per_row"] = models_per_row
-        self._save_config()
+        with self._lock:
+            if self._set_value(self.config["ui"], "models_per_row", models_per_row):
+                self._save_config()
 
     def update_model_parameters(
         self, provider: str, model_name: str, temperature: float, max_tokens: int
     ) -> None:
         """Update model parameters."""
-        if provider in self.config["providers"]:
-            for model in self.config["providers"][provider]["models"]:
-                if model["name"] == model_name:
-                    # Initialize parameters dict if it doesn't exist
-                    if "parameters" not in model:
-                        model["parameters"] = {}
-
-                    # Update temperature
-                    model["parameters"]["temperature"] = temperature
-
-                    # Update max tokens (using the right parameter name)
-                    if provider == "google":
-                        model["parameters"]["max_output_tokens"] = max_tokens
-                    else:
-                        model["parameters"]["max_tokens"] = max_tokens
-
-                    self._save_config()
-                    break
+        with self._lock:
+            if provider in self.config["providers"]:
+                for model in self.config["providers"][provider]["models"]:
+                    if model["name"] == model_name:
+                        # Initialize parameters dict if it doesn't exist
+                        if not model.get("parameters"):
+                            model["parameters"] = {}
+
+                        # Update temperature
+                        changed = self._set_value(
+                            model["parameters"], "temperature", temperature
+                        )
+
+                        # Update max tokens (using the right parameter name)
+                        changed = (
+                            self._set_value(
+                                model["parameters"],
+                                MAX_TOKENS_KEYS.get(provider, "max_tokens"),
+                                max_tokens,
+                            )
+                            or changed
+                        )
+
+                        if changed:
+                            self._save_config()
+                        break
 
     def add_model(
         self,
@@ -138,35 +249,35 @@ class ConfigManager:
         Returns:
             bool: Success or failure
         """
-        if provider not in self.config["providers"]:
-            return False
-
-        # Check if model already exists
-        for model in self.config["providers"][provider]["models"]:
-            if model["name"] == model_name:
+        with self._lock:
+            if provider not in self.config["providers"]:
                 return False
 
-        # Create new model configuration
-        new_model = {
-            "name": model_name,
-            "display_name": display_name,
-            "enabled": True,
-            "parameters": {},
-        }
+            # Check if model already exists
+            for model in self.config["providers"][provider]["models"]:
+                if model["name"] == model_name:
+                    return False
 
-        # Add the right parameter names based on provider
-        if provider == "google":
-            new_model["parameters"]["max_output_tokens"] = max_tokens
-        else:
-            new_model["parameters"]["max_tokens"] = max_tokens
+            # Create new model configuration
+            new_model = {
+                "name": model_name,
+                "display_name": display_name,
+                "enabled": True,
+                "parameters": {},
+            }
 
-        new_model["parameters"]["temperature"] = temperature
+            # Add the right parameter names based on provider
+            new_model["parameters"][
+                MAX_TOKENS_KEYS.get(provider, "max_tokens")
+            ] = max_tokens
 
-        # Add the model to the provider
-        self.config["providers"][provider]["models"].append(new_model)
-        self._save_config()
+            new_model["parameters"]["temperature"] = temperature
 
-        return True
+            # Add the model to the provider
+            self.config["providers"][provider]["models"].append(new_model)
+            self._save_config()
+
+            return True
 
     def add_provider(
         self,
@@ -191,35 +302,36 @@ class ConfigManager:
         Returns:
             bool: Success or failure
         """
-        # Check if provider already exists
-        if provider_id in self.config["providers"]:
-            return False
-
-        # Create provider configuration
-        new_provider = {
-            "api_key_env": api_key_env,
-            "class": provider_class,
-            "enabled": False,  # Disabled by default until API key is verified
-            "module": module_path,
-            "models": [],
-        }
+        with self._lock:
+            # Check if provider already exists
+            if provider_id in self.config["providers"]:
+                return False
 
-        # Add initial model if provided
-        if initial_model_name and initial_model_display_name:
-            new_provider["models"].append(
-                {
-                    "display_name": initial_model_display_name,
-                    "enabled": True,
-                    "name": initial_model_name,
-                    "parameters": {"max_tokens": 1024, "temperature": 0.7},
-                }
-            )
+            # Create provider configuration
+            new_provider = {
+                "api_key_env": api_key_env,
+                "class": provider_class,
+                "enabled": False,  # Disabled by default until API key is verified
+                "module": module_path,
+                "models": [],
+            }
+
+            # Add initial model if provided
+            if initial_model_name and initial_model_display_name:
+                new_provider["models"].append(
+                    {
+                        "display_name": initial_model_display_name,
+                        "enabled": True,
+                        "name": initial_model_name,
+                        "parameters": {"max_tokens": 1024, "temperature": 0.7},
+                    }
+                )
 
-        # Add the provider to the configuration
-        self.config["providers"][provider_id] = new_provider
-        self._save_config()
+            # Add the provider to the configuration
+            self.config["providers"][provider_id] = new_provider
+            self._save_config()
 
-        return True
+            return True
 
     def save_api_key(self, env_var_name: str, api_key_value: str) -> bool:
         """
@@ -233,25 +345,35 @@ class ConfigManager:
             bool: Success or failure
         """
         try:
-            # Find .env file in project root or create one if it doesn't exist
-            dotenv_path = find_dotenv()
-            if not dotenv_path:
-                dotenv_path = os.path.join(
-                    os.path.dirname(self.config_path), "..", ".env"
-                )
-                Path(dotenv_path).touch(exist_ok=True)
-
             # Update or add the environment variable
-            set_key(dotenv_path, env_var_name, api_key_value)
+            set_key(self._get_dotenv_path(), env_var_name, api_key_value)
 
-            # Reload environment variables
-            load_dotenv(dotenv_path, override=True)
+            # Only this variable changed, so set it directly rather than
+            # reloading the whole file
+            os.environ[env_var_name] = api_key_value
+            get_api_key_status.clear()
 
             return True
         except Exception as e:
             st.error(f"Error saving API key: {str(e)}")
             return False
 
+    def _get_dotenv_path(self) -> str:
+        """
+        Find the .env file in the project root, creating one if it doesn't
+        exist. The path is looked up once and reused for later saves.
+        """
+        if self._dotenv_path is None:
+            dotenv_path = find_dotenv()
+            if not dotenv_path:
+                dotenv_path = os.path.join(
+                    os.path.dirname(self.config_path), "..", ".env"
+                )
+            self._dotenv_path = dotenv_path
+        # Recreate the file if it was removed since it was found
+        Path(self._dotenv_path).touch(exist_ok=True)
+        return self._dotenv_path
+
     def _get_default_config(self) -> Dict[str, Any]:
         """Return a default configuration if the config file doesn't exist."""
         return {
@@ -277,3 +399,20 @@ class ConfigManager:
             "ui": {"models_per_row": 2, "max_chat_history": 10},
             "agent": {"parameters": {"markdown": False}},
         }
+
+
+@st.cache_resource
+def get_config_manager() -> ConfigManager:
+    """Get the ConfigManager instance shared across all sessions and reruns."""
+    return ConfigManager()
+
+
+@st.cache_resource
+def get_api_key_status(api_key_envs: Tuple[str, ...]) -> Dict[str, bool]:
+    """
+    Get whether each API key environment variable is set.
+
+    Environment variables only change through ConfigManager.save_api_key,
+    which clears this cache.
+    """
+    return {env: bool(os.environ.get(env)) for env in api_key_envs}
@@ -1,11 +1,14 @@
 import asyncio
 import importlib
 import os
+import threading
 from typing import Any, Callable, Dict
 
 from agno.agent import Agent
 
 from utils.config_manager import ConfigManager
+from utils.response_cache import ResponseCache
+from utils.streaming import pump_stream
 
 
 class LLMManager:
@@ -13,12 +16,25 @@ class LLMManager:
         self.config_manager = config_manager
         # Store session-specific agent instances
         self.session_agents = {}
+        # Responses to prompts sent without chat history, which are
+        # independent of the conversation so far
+        self.response_cache = ResponseCache()
 
     def _get_agent_for_model(self, model: Dict[str, Any]) -> Agent:
         """Create an Agno Agent for the specified model dynamically."""
         provider = model["provider"]
         model_id = model["name"]
         api_key_env = model["api_key_env"]
+        model_parameters = model.get("parameters", {})
+
+        # Check if we already have an agent for this model in the current session
+        # This ensures we maintain memory across calls in the same session, and
+        # skips the config and environment lookups below. The agent is rebuilt
+        # if the model's parameters have changed since it was created.
+        if model_id in self.session_agents:
+            agent_parameters, agent = self.session_agents[model_id]
+            if agent_parameters == model_parameters:
+                return agent
 
         # Get provider configuration
         provider_config = self.config_manager.get_provider_config(provider)
@@ -37,11 +53,6 @@ class LLMManager:
                 f"API key not found in environment variable '{api_key_env}'"
             )
 
-        # Check if we already have an agent for this model in the current session
-        # This ensures we maintain memory across calls in the same session
-        if model_id in self.session_agents:
-            return self.session_agents[model_id]
-
         # Import the module and class dynamically
         try:
             module_name = provider_config.get("module")
@@ -59,7 +70,7 @@ class LLMManager:
             model_class = getattr(module, class_name)
 
             # Prepare parameters
-            model_params = model.get("parameters", {}).copy()
+            model_params = model_parameters.copy()
 
             # Add model id and API key
             model_params["id"] = model_id
@@ -79,30 +90,57 @@ class LLMManager:
             )
 
             # Store the agent for reuse
-            self.session_agents[model_id] = agent
+            self.session_agents[model_id] = (model_parameters.copy(), agent)
             return agent
         except (ImportError, AttributeError) as e:
             raise ValueError(
                 f"Failed to load model class for {provider}: {str(e)}"
             ) from e
 
+    def clear_history(self) -> None:
+        """Clear the conversation memory of every agent in this session."""
+        for _, agent in self.session_agents.values():
+            if (
+                hasattr(agent, "memory")
+                and agent.memory
+                and hasattr(agent.memory, "clear")
+            ):
+                agent.memory.clear()
+
     async def stream_model(
         self, model: Dict[str, Any], prompt: str, callback: Callable[[str, str], None]
     ) -> None:
         """Stream responses from a specific model using Agno."""
         model_name = model["name"]
+        loop = asyncio.get_running_loop()
+        chunk_queue = asyncio.Queue()
+        stop_event = threading.Event()
+
+        def put(item: Any) -> None:
+            # Called from the worker thread, so hand the item to the loop
+            try:
+                loop.call_soon_threadsafe(chunk_queue.put_nowait, item)
+            except RuntimeError:
+                # The event loop has closed, so nothing is waiting for chunks
+                stop_event.set()
 
         try:
             agent = self._get_agent_for_model(model)
             run_response = agent.run(prompt, stream=True)
-
-            for chunk in run_response:
-                if chunk.content:
-                    callback(model_name, chunk.content)
-                    # Small sleep to allow UI updates
-                    await asyncio.sleep(0.01)
+            # The Agno generator blocks, so it is drained on a worker thread
+            threading.Thread(
+                target=pump_stream, args=(run_response, put, stop_event), daemon=True
+            ).start()
+
+            while (item := await chunk_queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                callback(model_name, item)
         except Exception as e:
             callback(model_name, f"Error: {str(e)}")
+        finally:
+            # Stop the worker if this task ends early, e.g. when cancelled
+            stop_event.set()
 
     async def stream_all_models(
         self, prompt: str, callbacks: Dict[str, Callable[[str], None]]
@@ -112,16 +150,16 @@ class LLMManager:
         tasks = []
 
         for model in enabled_models:
-            model_name = model["name"]
-
             # Skip if we don't have a callback for this model
-            if model_name not in callbacks:
+            callback = callbacks.get(model["name"])
+            if callback is None:
                 continue
 
-            # Create a task for streaming from this model
+            # The callback is bound per model rather than looked up in
+            # callbacks for every chunk
             tasks.append(
                 self.stream_model(
-                    model, prompt, lambda name, text: callbacks[name](text)
+                    model, prompt, lambda _, text, callback=callback: callback(text)
                 )
             )
 
@@ -0,0 +1,47 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class ResponseCache:
+    """A bounded LRU cache of complete model responses."""
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self._responses = OrderedDict()
+
+    @staticmethod
+    def make_key(
+        model: Dict[str, Any], agent_parameters: Dict[str, Any], prompt: str
+    ) -> str:
+        """
+        Build a cache key from the model, its parameters, the agent parameters
+        and the prompt.
+        """
+        payload = json.dumps(
+            {
+                "provider": model["provider"],
+                "model": model["name"],
+                "parameters": model.get("parameters", {}),
+                "agent_parameters": agent_parameters,
+                "prompt": prompt,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response, or None if there is none."""
+        response = self._responses.get(key)
+        if response is not None:
+            self._responses.move_to_end(key)
+        return response
+
+    def set(self, key: str, response: str) -> None:
+        """Cache a response, evicting the least recently used if full."""
+        self._responses[key] = response
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.max_size:
+            self._responses.popitem(last=False)
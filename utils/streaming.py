@@ -0,0 +1,32 @@
+import threading
+from typing import Any, Callable, Iterator
+
+
+def pump_stream(
+    generator: Iterator[Any],
+    put: Callable[[Any], None],
+    stop_event: threading.Event,
+) -> None:
+    """
+    Drain an Agno response generator, handing each chunk's content to put.
+
+    Meant to run on a worker thread, as the generator blocks while waiting
+    for the provider. Calls put(content) for each chunk, then put(None) when
+    the stream ends or put(exception) if it fails. Stops reading, without a
+    final call, once stop_event is set.
+    """
+    try:
+        for chunk in generator:
+            if stop_event.is_set():
+                return
+            content = chunk.content
+            if content:
+                put(content)
+        put(None)
+    except Exception as e:
+        put(e)
+    finally:
+        # Close the stream here, as a generator can only be closed by the
+        # thread running it, so an abandoned response is not read to the end
+        if hasattr(generator, "close"):
+            generator.close()